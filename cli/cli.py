@@ -1,103 +1,451 @@
 import click
+import click.shell_completion
 import re
 import boto3
+import botocore.session
 from pathlib import Path
-from sys import exit
+from collections.abc import Sized
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from itertools import islice
+from queue import Queue
+from random import uniform
+from threading import Event, Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
+from sys import exit, stderr
 from os import environ
 from progress.counter import Counter
 
-from botocore.exceptions import ClientError, EndpointConnectionError
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError, EndpointConnectionError, ProfileNotFound
+
+BATCH_WRITE_MAX_ITEMS = 25
+ALTERNATOR_BATCH_WRITE_MAX_ITEMS = 100
+AWS_ENDPOINT_DOMAINS = ('.amazonaws.com', '.amazonaws.com.cn', '.api.aws')
+UNPROCESSED_ITEMS_MAX_ATTEMPTS = 10
+UNPROCESSED_ITEMS_BACKOFF_BASE = 0.05
+UNPROCESSED_ITEMS_BACKOFF_CAP = 10
+WRITE_CAPACITY_TARGET_UTILIZATION = 0.8
+DEFAULT_SCAN_PARALLELISM = 8
+DEFAULT_WRITERS = 10
+PROGRESS_UPDATE_INTERVAL = 0.1
+LOG_PROGRESS_EVERY = 10_000
+BULK_COPY_MIN_BYTES = 10 * 1024 ** 3
+BULK_COPY_MIN_ITEMS = 100_000_000
+BULK_COPY_POLL_INTERVAL = 30
+
+_PROFILE_RE = re.compile(r'^\[([\s\w\-]+)\]$')
+
+# Sessions aren't thread-safe, so clients and resources are created from them one at a time
+_session_lock = Lock()
+
+# DynamoDB resources by profile, region and endpoint, and the plain low-level client created alongside each one,
+# keyed by the resource's own client. Both are only read and written while holding the session lock.
+_dynamodb_resources = {}
+_low_level_clients = {}
+
+# Keep enough pooled connections for every scan and write thread to hold one at once, and let botocore's adaptive
+# retry mode slow the client down when DynamoDB starts throttling
+_dynamodb_config = Config(
+    max_pool_connections=max(DEFAULT_SCAN_PARALLELISM + DEFAULT_WRITERS, 50),
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+)
+
+
+class RawNumber(str):
+    """A DynamoDB number kept as the string it was sent as, rather than being parsed into a Decimal"""
+
+
+class RawNumberDeserializer(TypeDeserializer):
+    """A TypeDeserializer that leaves numbers as RawNumber strings, skipping the cost of building a Decimal"""
+
+    def _deserialize_n(self, value):
+        return RawNumber(value)
+
+
+class RawNumberSerializer(TypeSerializer):
+    """A TypeSerializer that writes RawNumber strings back out as numbers without re-parsing them"""
+
+    def _is_number(self, value):
+        return isinstance(value, RawNumber) or super()._is_number(value)
+
+    def _serialize_n(self, value):
+        if isinstance(value, RawNumber):
+            return str(value)
+        return super()._serialize_n(value)
+
+
+_serializer = RawNumberSerializer()
+_deserializer = RawNumberDeserializer()
 
 
 def get_profile_names():
-    """Get a list of profile names from the AWS credentials file"""
+    """Get a list of profile names from the AWS credentials file, or an empty list if there is no credentials file"""
     profile_names = []
 
     credentials_path = Path("~/.aws/credentials").expanduser()
     if 'AWS_SHARED_CREDENTIALS_FILE' in environ:
         credentials_path = Path(environ['AWS_SHARED_CREDENTIALS_FILE'])
 
+    if not credentials_path.is_file():
+        return profile_names
+
     with open(credentials_path) as f:
-        lines = f.readlines()
-        for line in lines:
-            if match := re.match(r'^\[([\s\w\-]+)\]$', line):
+        for line in f:
+            if match := _PROFILE_RE.match(line):
                 profile_names.append(match.group(1))
     return profile_names
 
 
-def validate_aws_credentials(profile_name, region_name):
+class ThrottledCounter(Counter):
+    """
+    A progress Counter that can be advanced from several threads and redraws at most once per interval, so large copies
+    don't spend their time rendering the terminal
+    """
+
+    def __init__(self, message='', interval=PROGRESS_UPDATE_INTERVAL, **kwargs):
+        self._interval = interval
+        self._pending = 0
+        self._last_update = monotonic()
+        self._lock = Lock()
+        super().__init__(message, **kwargs)
+
+    def next(self, n=1):
+        with self._lock:
+            self._pending += n
+            now = monotonic()
+            if now - self._last_update < self._interval:
+                return
+            n, self._pending = self._pending, 0
+            self._last_update = now
+            super().next(n)
+
+    def finish(self):
+        with self._lock:
+            if self._pending:
+                n, self._pending = self._pending, 0
+                super().next(n)
+        super().finish()
+
+
+class LogCounter:
+    """
+    A stand-in for a progress Counter when stderr isn't a terminal, e.g. in CI logs, which prints a plain line every
+    so many items instead of redrawing the counter
+    """
+
+    def __init__(self, message='', every=LOG_PROGRESS_EVERY):
+        self.message = message
+        self.index = 0
+        self._every = every
+        self._next_log = every
+        self._finished = False
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.finish()
+
+    def next(self, n=1):
+        with self._lock:
+            self.index += n
+            if self.index >= self._next_log:
+                self._next_log = (self.index // self._every + 1) * self._every
+                print(f"{self.message}{self.index:,}", file=stderr)
+
+    def finish(self):
+        with self._lock:
+            if not self._finished:
+                self._finished = True
+                print(f"{self.message}{self.index:,}", file=stderr)
+
+
+def progress_counter(message):
+    """
+    Create a counter for reporting progress: a redrawing counter on a terminal, or periodic log lines otherwise
+
+    :param message: the message to show before the count
+    :return: a ThrottledCounter or LogCounter
+    """
+    if stderr.isatty():
+        return ThrottledCounter(message)
+    return LogCounter(message)
+
+
+class ProfileName(click.ParamType):
+    """
+    A Click parameter type for an AWS profile name from the credentials or config file, including SSO profiles. The
+    files are only read when a value is actually converted or completed, so `--help` and importing the module never
+    touch the disk.
+    """
+    name = 'profile'
+
+    def convert(self, value, param, ctx):
+        profile_names = botocore.session.Session().available_profiles
+        if value not in profile_names:
+            choices = ", ".join(map(repr, profile_names)) or "none are configured"
+            self.fail(f"The profile {value!r} could not be found ({choices}).", param, ctx)
+        return value
+
+    def shell_complete(self, ctx, param, incomplete):
+        return [click.shell_completion.CompletionItem(profile_name)
+                for profile_name in botocore.session.Session().available_profiles
+                if profile_name.startswith(incomplete)]
+
+
+@lru_cache(maxsize=None)
+def _session(profile_name, region_name):
+    """
+    Get the boto3 Session for a profile and region, creating it only once so credentials and config are loaded once
+
+    :param profile_name: the name of an AWS profile, or None for boto3's default credential chain
+    :param region_name: a valid AWS region name
+    :return: a boto3 Session or exit with a non-zero exit code
+    """
+    try:
+        return boto3.Session(profile_name=profile_name, region_name=region_name)
+    except ProfileNotFound as e:
+        print(f"ERROR: {e}")
+        exit(1)
+
+
+def _dynamodb_resource(profile_name, region_name, endpoint_url=None):
+    """
+    Get the DynamoDB Service Resource for a profile and region, along with a plain low-level client for the same
+    profile, region and endpoint that get_dynamodb_client returns for its tables. Every Table created from it shares
+    those clients, so the scan and batch write threads reuse one connection pool.
+
+    :param profile_name: the name of an AWS profile, or None for boto3's default credential chain
+    :param region_name: a valid AWS region name
+    :param endpoint_url: an optional DynamoDB-compatible endpoint to use instead of AWS
+    :return: a boto3 DynamoDB Service Resource
+    """
+    key = (profile_name, region_name, endpoint_url)
+    with _session_lock:
+        if key not in _dynamodb_resources:
+            session = _session(profile_name, region_name)
+            resource = session.resource('dynamodb', endpoint_url=endpoint_url, config=_dynamodb_config)
+            _low_level_clients[resource.meta.client] = session.client('dynamodb', endpoint_url=endpoint_url,
+                                                                      config=_dynamodb_config)
+            _dynamodb_resources[key] = resource
+        return _dynamodb_resources[key]
+
+
+def get_dynamodb_client(table):
+    """
+    Get the plain low-level DynamoDB Client for a table. A Table's own client converts items to and from Python types
+    on every call; this one sends and receives DynamoDB attribute values unchanged. Tables loaded with
+    get_dynamodb_table already have one; for any other Table, one is created with the same region, endpoint, config and
+    credentials as the Table's own client.
+
+    :param table: a boto3 DynamoDB Table Service Resource
+    :return: a boto3 DynamoDB Client
+    """
+    resource_client = table.meta.client
+    with _session_lock:
+        if resource_client not in _low_level_clients:
+            # Share the Table client's credentials object rather than a frozen copy, so refreshable credentials keep
+            # refreshing during a long copy
+            botocore_session = botocore.session.get_session()
+            botocore_session._credentials = resource_client._request_signer._credentials
+            session = boto3.Session(botocore_session=botocore_session,
+                                    region_name=resource_client.meta.region_name)
+            _low_level_clients[resource_client] = session.client('dynamodb',
+                                                                 endpoint_url=resource_client.meta.endpoint_url,
+                                                                 config=resource_client.meta.config)
+        return _low_level_clients[resource_client]
+
+
+def is_aws_endpoint(endpoint_url):
+    """
+    Check whether an endpoint URL refers to AWS itself
+
+    :param endpoint_url: a DynamoDB endpoint URL, or None for the default AWS endpoint
+    :return: True if the endpoint is an AWS one
+    """
+    if endpoint_url is None:
+        return True
+    hostname = urlparse(endpoint_url).hostname or ''
+    return hostname.endswith(AWS_ENDPOINT_DOMAINS)
+
+
+@lru_cache(maxsize=None)
+def _dynamodb_regions():
+    """
+    Get the names of every region DynamoDB is available in, from the endpoint data bundled with botocore
+
+    :return: a set of region names
+    """
+    session = boto3.Session()
+    return {region_name
+            for partition_name in session.get_available_partitions()
+            for region_name in session.get_available_regions('dynamodb', partition_name)}
+
+
+@lru_cache(maxsize=None)
+def _partition_region_patterns():
+    """
+    Get the patterns region names follow in each AWS partition, from the endpoint data bundled with botocore. They
+    also match regions launched after that version of botocore was released.
+
+    :return: a list of compiled regular expressions
+    """
+    partitions = botocore.session.get_session().get_data('endpoints')['partitions']
+    return [re.compile(partition['regionRegex']) for partition in partitions]
+
+
+def validate_region(region_name, endpoint_url=None):
+    """
+    Check a region name locally, so a typo fails straight away instead of after a failed connection. Names that follow
+    an AWS partition's naming but aren't known to this version of botocore only get a warning, since the region may be
+    newer.
+
+    :param region_name: an AWS region name
+    :param endpoint_url: an optional DynamoDB-compatible endpoint, which may use any region name
+    :return: the region name or exit with a non-zero exit code
+    """
+    if not is_aws_endpoint(endpoint_url) or region_name in _dynamodb_regions():
+        return region_name
+
+    if not any(pattern.match(region_name) for pattern in _partition_region_patterns()):
+        print(f"ERROR Invalid Region: The region '{region_name}' does not appear to be a valid AWS region.")
+        exit(1)
+
+    print(f"WARNING: The region '{region_name}' is not known to this version of botocore.", file=stderr)
+    return region_name
+
+
+def validate_aws_credentials(profile_name, region_name, endpoint_url=None):
     """
     Use the given AWS credentials to make a simple API call to ensure they are valid
 
-    :param profile_name: the name of an AWS profile in the credentials file
+    :param profile_name: the name of an AWS profile, or None for boto3's default credential chain
     :param region_name: a valid AWS region name
+    :param endpoint_url: an optional DynamoDB-compatible endpoint to validate the credentials against instead of STS
     :return: an STS get-caller-identity response or exit with a non-zero exit code
     """
     token_error_msg = "ERROR: Security token issue: "
+    credentials = f"Credentials for profile '{profile_name}'" if profile_name else "The default credentials"
     try:
-        sts_client = boto3.session.Session(profile_name=profile_name).client('sts', region_name=region_name)
+        if not is_aws_endpoint(endpoint_url):
+            # There is no STS behind a local or third-party endpoint, so ask DynamoDB itself
+            _dynamodb_resource(profile_name, region_name, endpoint_url).meta.client.list_tables(Limit=1)
+            return None
+
+        with _session_lock:
+            sts_client = _session(profile_name, region_name).client('sts')
         resp = sts_client.get_caller_identity()
         return resp['Account']
     except ClientError as e:
         if e.response['Error']['Code'] == "ExpiredToken":
-            print(f"{token_error_msg} Credentials for profile '{profile_name}' are expired.")
+            print(f"{token_error_msg} {credentials} are expired.")
             exit(1)
-        if e.response['Error']['Code'] == "InvalidClientTokenId":
-            print(f"{token_error_msg} Credentials for profile '{profile_name}' are invalid or do not have access to "
+        if e.response['Error']['Code'] in ("InvalidClientTokenId", "UnrecognizedClientException"):
+            print(f"{token_error_msg} {credentials} are invalid or do not have access to "
                   f"region '{region_name}'.")
             exit(1)
     except EndpointConnectionError as e:
+        if not is_aws_endpoint(endpoint_url):
+            print(f"ERROR Invalid Endpoint: Could not connect to the endpoint '{endpoint_url}'.")
+            exit(1)
         print(f"ERROR Invalid Region: The region '{region_name}' does not appear to be a valid AWS region.")
         exit(1)
 
 
-def get_dynamodb_table(table_name, profile_name, region_name):
+def get_dynamodb_table(table_name, profile_name, region_name, endpoint_url=None):
     """
     Create a boto3 DynamoDB Table resource for the given table
 
     :param table_name: the name of a DynamoDB table
-    :param profile_name: the AWS credentials to use
+    :param profile_name: the AWS profile to use, or None for boto3's default credential chain
     :param region_name: the region where the table exists
+    :param endpoint_url: an optional DynamoDB-compatible endpoint to use instead of AWS
     :return: a boto3 DynamoDB Table resource object
     """
 
-    dynamodb_client = boto3.Session(profile_name=profile_name, region_name=region_name).resource('dynamodb')
+    dynamodb_client = _dynamodb_resource(profile_name, region_name, endpoint_url)
     table = dynamodb_client.Table(table_name)
     try:
         table.load()
     except dynamodb_client.meta.client.exceptions.ResourceNotFoundException:
         print(f"ERROR: count not find the table named '{table_name}'")
         exit(1)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ("ExpiredTokenException", "UnrecognizedClientException"):
+            credentials = f"Credentials for profile '{profile_name}'" if profile_name else "The default credentials"
+            print(f"ERROR: Security token issue: {credentials} are expired, invalid or do not have access to region "
+                  f"'{region_name}'.")
+            exit(1)
+        raise
+    except EndpointConnectionError as e:
+        print(f"ERROR: Could not connect to DynamoDB at '{e.kwargs['endpoint_url']}'.")
+        exit(1)
 
     return table
 
 
-def get_dynamodb_items(table):
+def get_dynamodb_items(table, parallelism=DEFAULT_SCAN_PARALLELISM):
     """
-    Get all the items from a table.
+    Get all the items from a table using a parallel, segmented scan.
 
-    :param table: a boto3 Table Resource object
-    :return: a list of dict with the items
+    Unlike a Table Resource scan, numbers are returned as RawNumber, a str subclass holding the number as DynamoDB sent
+    it, instead of Decimal. Building a Decimal for every number is the most expensive part of reading a table, and the
+    value is only ever written back out. Convert a RawNumber with Decimal(value) where the number itself is needed.
+
+    :param table: a boto3 Table Resource object returned by get_dynamodb_table
+    :param parallelism: the number of scan segments to read concurrently
+    :return: a list of dict with the items, with numbers as RawNumber strings
     """
+    items = get_dynamodb_items_raw(get_dynamodb_client(table), table.table_name, parallelism)
+    return [_deserialize_item(item) for item in items]
+
 
+def get_dynamodb_items_raw(client, table_name, parallelism=DEFAULT_SCAN_PARALLELISM):
+    """
+    Get all the items from a table using a parallel, segmented scan through the low-level client. The items are left
+    in the DynamoDB attribute value format, so they can be written back out without any conversion.
+
+    :param client: a boto3 DynamoDB Client
+    :param table_name: the name of a DynamoDB table
+    :param parallelism: the number of scan segments to read concurrently
+    :return: a list of dict with the items as DynamoDB attribute values
+    """
+    return _scan_all(partial(client.scan, TableName=table_name), table_name, parallelism)
+
+
+def iter_dynamodb_items(table, parallelism=DEFAULT_SCAN_PARALLELISM, queue_maxsize=32):
+    """
+    Iterate over the pages of items in a table as they arrive from a parallel, segmented scan, without holding the
+    whole table in memory. As with get_dynamodb_items, numbers are returned as RawNumber strings rather than Decimal.
+
+    :param table: a boto3 Table Resource object returned by get_dynamodb_table
+    :param parallelism: the number of scan segments to read concurrently
+    :param queue_maxsize: the maximum number of scanned pages waiting to be consumed
+    :return: a generator of lists of dict with the items, with numbers as RawNumber strings
+    """
+    scan = partial(get_dynamodb_client(table).scan, TableName=table.table_name)
+    for resp in _iter_pages(scan, parallelism, queue_maxsize):
+        yield [_deserialize_item(item) for item in resp['Items']]
+
+
+def _scan_all(scan, table_name, parallelism):
+    """
+    Collect every page returned by a scan, reading the segments concurrently
+
+    :param scan: the scan method of a boto3 Table Resource or Client, bound to the table
+    :param table_name: the name of the table being scanned
+    :param parallelism: the number of scan segments to read concurrently
+    :return: a list of dict with the items
+    """
     items = []
-    progress_msg = f"Downloading items from {table.table_name}: "
-    with Counter(progress_msg) as bar:
-        resp = table.scan()
-        items += resp['Items']
-        if 'LastEvaluatedKey' in resp:
-            last_evaluated_key = resp['LastEvaluatedKey']
-        else:
-            last_evaluated_key = None
-        bar.next(resp['Count'])
-
-        while last_evaluated_key is not None:
-            resp = table.scan(ExclusiveStartKey=last_evaluated_key)
+    progress_msg = f"Downloading items from {table_name}: "
+    with progress_counter(progress_msg) as bar:
+        for resp in _iter_pages(scan, parallelism):
             items += resp['Items']
-            if 'LastEvaluatedKey' in resp:
-                last_evaluated_key = resp['LastEvaluatedKey']
-            else:
-                last_evaluated_key = None
             bar.next(resp['Count'])
 
         bar.finish()
@@ -105,52 +453,508 @@ def get_dynamodb_items(table):
     return items
 
 
-def write_items_to_dyanmodb_table(items, table):
+def _iter_pages(scan, parallelism, queue_maxsize=32):
+    """
+    Yield every page returned by a scan in the order they arrive, reading the segments concurrently
+
+    :param scan: the scan method of a boto3 Table Resource or Client, bound to the table
+    :param parallelism: the number of scan segments to read concurrently
+    :param queue_maxsize: the maximum number of scanned pages waiting to be consumed
+    :return: a generator of scan responses
+    """
+    if parallelism == 1:
+        yield from _scan_pages(scan)
+        return
+
+    pages = Queue(maxsize=queue_maxsize)
+    stopped = Event()
+
+    def scan_segment(segment):
+        try:
+            for resp in _scan_pages(scan, segment, parallelism):
+                if stopped.is_set():
+                    break
+                pages.put(resp)
+        except Exception:
+            # Stop the other segments too, as the scan has failed
+            stopped.set()
+            raise
+        finally:
+            pages.put(None)
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [executor.submit(scan_segment, segment) for segment in range(parallelism)]
+        remaining = parallelism
+        try:
+            while remaining:
+                if (resp := pages.get()) is None:
+                    remaining -= 1
+                else:
+                    yield resp
+        finally:
+            # If the caller stops early, let the segments wind down without blocking on a full queue
+            stopped.set()
+            while remaining:
+                if pages.get() is None:
+                    remaining -= 1
+
+        for future in futures:
+            future.result()
+
+
+def _scan_pages(scan, segment=None, total_segments=None):
+    """
+    Scan a table, or a single segment of it, yielding each page until there are no more.
+
+    :param scan: the scan method of a boto3 Table Resource or Client, bound to the table
+    :param segment: the segment number to scan, or None to scan the whole table
+    :param total_segments: the total number of segments the table is split into
+    :return: a generator of scan responses
+    """
+    scan_kwargs = {}
+    if segment is not None:
+        scan_kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+
+    while True:
+        resp = scan(**scan_kwargs)
+        yield resp
+
+        if 'LastEvaluatedKey' not in resp:
+            break
+        scan_kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+class RateLimiter:
+    """A thread-safe limiter that spaces out work so no more than a given number of units are acquired per second"""
+
+    def __init__(self, rate):
+        """
+        :param rate: the number of units that may be acquired per second
+        """
+        self.rate = rate
+        self._deadline = monotonic()
+        self._lock = Lock()
+
+    def acquire(self, units=1):
+        """
+        Block until the given number of units can be used without exceeding the rate
+
+        :param units: the number of units about to be used
+        :return:
+        """
+        with self._lock:
+            now = monotonic()
+            self._deadline = max(now, self._deadline) + units / self.rate
+            delay = self._deadline - now
+        sleep(delay)
+
+
+def get_write_rate_limiter(table, target_wps=None):
     """
-    Use the DynamoDB batch write API to write the provided items to a given table
+    Build a RateLimiter for writes to a table, targeting a fraction of its provisioned write capacity
 
-    :param items: a list of items to write
     :param table: a boto3 DynamoDB Table Service Resource for the table to be written to
+    :param target_wps: an explicit number of items to write per second, for tables using on-demand capacity
+    :return: a RateLimiter, or None if the table's writes should not be limited
+    """
+    if target_wps:
+        return RateLimiter(target_wps)
+
+    write_capacity_units = (table.provisioned_throughput or {}).get('WriteCapacityUnits', 0)
+    if write_capacity_units > 0:
+        return RateLimiter(write_capacity_units * WRITE_CAPACITY_TARGET_UTILIZATION)
+
+    return None
+
+
+def write_items_to_dyanmodb_table(items, table, writers=DEFAULT_WRITERS, rate_limiter=None,
+                                  batch_size=BATCH_WRITE_MAX_ITEMS):
+    """
+    Use the DynamoDB batch write API to write the provided items to a given table, sending batches concurrently
+
+    :param items: an iterable of items to write
+    :param table: a boto3 DynamoDB Table Service Resource for the table to be written to
+    :param writers: the number of BatchWriteItem calls to have in flight at once
+    :param rate_limiter: an optional RateLimiter bounding the number of items written per second
+    :param batch_size: the number of items to send in each BatchWriteItem call
     :return:
     """
-    item_count = len(items)
-    with table.batch_writer() as batch:
-        progress_msg = f"Writing {item_count:,} items to {table.table_name}: "
-        with Counter(progress_msg) as bar:
-            for item in items:
-                batch.put_item(Item=item)
-                bar.next()
+    if isinstance(items, Sized):
+        progress_msg = f"Writing {len(items):,} items to {table.table_name}: "
+    else:
+        progress_msg = f"Writing items to {table.table_name}: "
+    with progress_counter(progress_msg) as bar:
+        with ThreadPoolExecutor(max_workers=writers) as executor:
+            # Only keep a couple of batches queued per writer so a slow destination applies back-pressure
+            pending = set()
+            for batch in _batches((_serialize_item(item) for item in items), batch_size):
+                pending.add(executor.submit(_write_batch, table, batch, rate_limiter))
+                if len(pending) >= writers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        bar.next(future.result())
+            for future in as_completed(pending):
+                bar.next(future.result())
         bar.finish()
 
 
+def _batches(items, batch_size=BATCH_WRITE_MAX_ITEMS):
+    """
+    Split an iterable of items into lists small enough for a single BatchWriteItem call
+
+    :param items: an iterable of items
+    :param batch_size: the maximum number of items in each batch
+    :return: a generator of lists of items
+    """
+    items = iter(items)
+    while batch := list(islice(items, batch_size)):
+        yield batch
+
+
+def _write_batch(table, batch, rate_limiter=None):
+    """
+    Write a single batch of items with the low-level BatchWriteItem API, resubmitting any unprocessed items with
+    full-jitter exponential backoff
+
+    :param table: a boto3 DynamoDB Table Service Resource for the table to be written to
+    :param batch: a list of items as DynamoDB attribute values, small enough for one BatchWriteItem call
+    :param rate_limiter: an optional RateLimiter to acquire a token from for every item sent
+    :return: the number of items written
+    """
+    request_items = {
+        table.table_name: [{'PutRequest': {'Item': item}} for item in batch]
+    }
+    client = get_dynamodb_client(table)
+    if rate_limiter is not None:
+        rate_limiter.acquire(len(batch))
+    resp = client.batch_write_item(RequestItems=request_items)
+
+    for attempt in range(UNPROCESSED_ITEMS_MAX_ATTEMPTS):
+        if not resp.get('UnprocessedItems'):
+            return len(batch)
+        sleep(uniform(0, min(UNPROCESSED_ITEMS_BACKOFF_CAP, UNPROCESSED_ITEMS_BACKOFF_BASE * 2 ** attempt)))
+        if rate_limiter is not None:
+            rate_limiter.acquire(sum(len(requests) for requests in resp['UnprocessedItems'].values()))
+        resp = client.batch_write_item(RequestItems=resp['UnprocessedItems'])
+
+    if resp.get('UnprocessedItems'):
+        unprocessed_count = sum(len(requests) for requests in resp['UnprocessedItems'].values())
+        raise RuntimeError(f"{unprocessed_count} items could not be written to {table.table_name} after "
+                           f"{UNPROCESSED_ITEMS_MAX_ATTEMPTS} retries")
+
+    return len(batch)
+
+
+def _serialize_item(item):
+    """
+    Convert an item from Python types into the DynamoDB attribute value format used by the low-level client
+
+    :param item: a dict of Python values, as returned by get_dynamodb_items
+    :return: a dict of DynamoDB attribute values
+    """
+    return {key: _serializer.serialize(value) for key, value in item.items()}
+
+
+def _deserialize_item(item):
+    """
+    Convert an item from the DynamoDB attribute value format into Python types, leaving numbers as RawNumber strings
+
+    :param item: a dict of DynamoDB attribute values, as returned by a low-level client scan
+    :return: a dict of Python values
+    """
+    return {key: _deserializer.deserialize(value) for key, value in item.items()}
+
+
+def copy_table(src_table, dest_table, parallelism=DEFAULT_SCAN_PARALLELISM, writers=DEFAULT_WRITERS, queue_maxsize=32,
+               rate_limiter=None, batch_size=BATCH_WRITE_MAX_ITEMS):
+    """
+    Stream the items of one table into another, writing pages as soon as they are scanned.
+
+    Scan segments are read concurrently and each page is handed to a pool of batch writers through a bounded queue, so
+    only a limited number of pages are ever held in memory and downloading overlaps with uploading. Both sides use the
+    low-level client, so items are passed through in the DynamoDB attribute value format without being converted.
+
+    :param src_table: a boto3 DynamoDB Table Service Resource for the table to be read from
+    :param dest_table: a boto3 DynamoDB Table Service Resource for the table to be written to
+    :param parallelism: the number of scan segments to read concurrently
+    :param writers: the number of threads writing to the destination table
+    :param queue_maxsize: the maximum number of scanned pages waiting to be written
+    :param rate_limiter: an optional RateLimiter bounding the number of items written per second
+    :param batch_size: the number of items to send in each BatchWriteItem call
+    :return:
+    """
+    pages = Queue(maxsize=queue_maxsize)
+    scan = partial(get_dynamodb_client(src_table).scan, TableName=src_table.table_name)
+
+    progress_msg = f"Copying items from {src_table.table_name} to {dest_table.table_name}: "
+    with progress_counter(progress_msg) as bar:
+        stopped = Event()
+
+        def scan_segment(segment=None):
+            try:
+                for resp in _scan_pages(scan, segment, parallelism):
+                    if stopped.is_set():
+                        break
+                    pages.put(resp['Items'])
+            except Exception:
+                stopped.set()
+                raise
+
+        def write_pages():
+            # After a failure in any scanner or writer, stop writing and keep draining the queue so no scanner blocks
+            # on a full queue
+            error = None
+            while (items := pages.get()) is not None:
+                if stopped.is_set():
+                    continue
+                try:
+                    for batch in _batches(items, batch_size):
+                        if stopped.is_set():
+                            break
+                        written = _write_batch(dest_table, batch, rate_limiter)
+                        bar.next(written)
+                except Exception as e:
+                    error = e
+                    stopped.set()
+            if error is not None:
+                raise error
+
+        with ThreadPoolExecutor(max_workers=writers) as write_executor:
+            write_futures = [write_executor.submit(write_pages) for _ in range(writers)]
+            try:
+                if parallelism == 1:
+                    scan_segment()
+                else:
+                    with ThreadPoolExecutor(max_workers=parallelism) as scan_executor:
+                        scan_futures = [scan_executor.submit(scan_segment, segment) for segment in range(parallelism)]
+                        for future in scan_futures:
+                            future.result()
+            finally:
+                for _ in range(writers):
+                    pages.put(None)
+
+            for future in write_futures:
+                future.result()
+
+        bar.finish()
+
+
+def should_copy_via_s3(table):
+    """
+    Decide whether a table is large enough that exporting it to S3 and importing it is faster than scanning it
+
+    :param table: a boto3 DynamoDB Table Service Resource for the table to be read from
+    :return: True if the table should be copied through S3
+    """
+    return table.table_size_bytes >= BULK_COPY_MIN_BYTES or table.item_count >= BULK_COPY_MIN_ITEMS
+
+
+def copy_table_via_s3(src_table, dest_client, dest_table_name, bucket, prefix=None,
+                      poll_interval=BULK_COPY_POLL_INTERVAL):
+    """
+    Copy a table by exporting it to S3 and importing the export as a new table. Neither step consumes the tables'
+    read or write capacity, so this is the fastest way to copy very large tables.
+
+    The source table must have point-in-time recovery enabled, and the destination table must not exist yet, since
+    importing always creates a new table. It is created with the source table's keys, capacity and global secondary
+    indexes; local secondary indexes can't be created by an import.
+
+    :param src_table: a boto3 DynamoDB Table Service Resource for the table to be read from
+    :param dest_client: a boto3 DynamoDB Client for the account and region to create the destination table in
+    :param dest_table_name: the name of the table to create
+    :param bucket: the name of the S3 bucket to export to and import from
+    :param prefix: an optional key prefix for the export within the bucket
+    :param poll_interval: the number of seconds to wait between checks on the export and import
+    :return:
+    """
+    # Importing can only create a new table, so make sure it will succeed before spending time on the export
+    try:
+        dest_client.describe_table(TableName=dest_table_name)
+        print(f"ERROR: the table '{dest_table_name}' already exists; a bulk copy must create the destination table")
+        exit(1)
+    except dest_client.exceptions.ResourceNotFoundException:
+        pass
+
+    src_client = src_table.meta.client
+
+    export_kwargs = {'S3Prefix': prefix} if prefix else {}
+    try:
+        resp = src_client.export_table_to_point_in_time(TableArn=src_table.table_arn, S3Bucket=bucket,
+                                                        ExportFormat='DYNAMODB_JSON', **export_kwargs)
+    except src_client.exceptions.PointInTimeRecoveryUnavailableException:
+        print(f"ERROR: point-in-time recovery must be enabled on '{src_table.table_name}' to export it")
+        exit(1)
+
+    print(f"Exporting {src_table.table_name} to s3://{bucket}/{prefix or ''}")
+    export = resp['ExportDescription']
+    while export['ExportStatus'] == 'IN_PROGRESS':
+        sleep(poll_interval)
+        export = src_client.describe_export(ExportArn=export['ExportArn'])['ExportDescription']
+    if export['ExportStatus'] != 'COMPLETED':
+        print(f"ERROR: the export of '{src_table.table_name}' failed: {export.get('FailureMessage')}")
+        exit(1)
+
+    # The exported items are written next to the export's manifest files, under data/
+    data_prefix = f"{export['ExportManifest'].rsplit('/', 1)[0]}/data/"
+
+    print(f"Importing s3://{bucket}/{data_prefix} into {dest_table_name}")
+    try:
+        resp = dest_client.import_table(
+            S3BucketSource={'S3Bucket': bucket, 'S3KeyPrefix': data_prefix},
+            InputFormat='DYNAMODB_JSON',
+            InputCompressionType='GZIP',
+            TableCreationParameters=_table_creation_parameters(src_table, dest_table_name),
+        )
+    except ClientError as e:
+        print(f"ERROR: could not import s3://{bucket}/{data_prefix} into '{dest_table_name}': "
+              f"{e.response['Error']['Message']}")
+        exit(1)
+    table_import = resp['ImportTableDescription']
+    while table_import['ImportStatus'] == 'IN_PROGRESS':
+        sleep(poll_interval)
+        table_import = dest_client.describe_import(ImportArn=table_import['ImportArn'])['ImportTableDescription']
+    if table_import['ImportStatus'] != 'COMPLETED':
+        print(f"ERROR: the import into '{dest_table_name}' failed: {table_import.get('FailureMessage')}")
+        exit(1)
+
+    print(f"Imported {table_import.get('ImportedItemCount', 0):,} items into {dest_table_name}")
+
+
+def _table_creation_parameters(table, table_name):
+    """
+    Build the ImportTable creation parameters for a new table with the same structure as an existing one
+
+    :param table: a boto3 DynamoDB Table Service Resource for the table to copy the structure of
+    :param table_name: the name of the new table
+    :return: a dict of TableCreationParameters
+    """
+    billing_mode = (table.billing_mode_summary or {}).get('BillingMode', 'PROVISIONED')
+
+    def throughput(provisioned_throughput):
+        return {
+            'ReadCapacityUnits': provisioned_throughput['ReadCapacityUnits'],
+            'WriteCapacityUnits': provisioned_throughput['WriteCapacityUnits'],
+        }
+
+    # Only keep the definitions of attributes used by the keys being created. Those only used by local secondary
+    # indexes, which aren't created, would make the import fail.
+    key_schemas = [table.key_schema] + [index['KeySchema'] for index in table.global_secondary_indexes or []]
+    key_attribute_names = {key['AttributeName'] for key_schema in key_schemas for key in key_schema}
+
+    params = {
+        'TableName': table_name,
+        'AttributeDefinitions': [definition for definition in table.attribute_definitions
+                                 if definition['AttributeName'] in key_attribute_names],
+        'KeySchema': table.key_schema,
+        'BillingMode': billing_mode,
+    }
+    if billing_mode == 'PROVISIONED':
+        params['ProvisionedThroughput'] = throughput(table.provisioned_throughput)
+
+    if table.global_secondary_indexes:
+        params['GlobalSecondaryIndexes'] = []
+        for index in table.global_secondary_indexes:
+            index_params = {
+                'IndexName': index['IndexName'],
+                'KeySchema': index['KeySchema'],
+                'Projection': index['Projection'],
+            }
+            if billing_mode == 'PROVISIONED':
+                index_params['ProvisionedThroughput'] = throughput(index['ProvisionedThroughput'])
+            params['GlobalSecondaryIndexes'].append(index_params)
+
+    return params
+
+
 @click.command()
 @click.option('-st', '--src-table-name', prompt=f"Source table name")
-@click.option('-sp', '--src-profile', prompt="Source AWS profile name", type=click.Choice(get_profile_names()))
+@click.option('-sp', '--src-profile', type=ProfileName(), default=None,
+              help="The AWS profile to read with; defaults to boto3's credential chain, e.g. AWS_PROFILE, environment "
+                   "variables or an instance profile")
 @click.option('-sr', '--src-region', prompt="Source AWS region name")
 @click.option('-dt', '--dest-table-name', prompt="Destination table name")
-@click.option('-dp', '--dest-profile', prompt="Destination AWS profile name", type=click.Choice(get_profile_names()))
+@click.option('-dp', '--dest-profile', type=ProfileName(), default=None,
+              help="The AWS profile to write with; defaults to boto3's credential chain")
 @click.option('-dr', '--dest-region', prompt="Destination AWS region name")
-def run(src_table_name, src_profile, src_region, dest_table_name, dest_profile, dest_region):
+@click.option('--src-endpoint-url', default=None,
+              help="A DynamoDB-compatible endpoint to read from instead of AWS, e.g. DynamoDB Local")
+@click.option('--dest-endpoint-url', default=None,
+              help="A DynamoDB-compatible endpoint to write to instead of AWS, e.g. DynamoDB Local or ScyllaDB "
+                   "Alternator")
+@click.option('--target-wps', type=click.FloatRange(min=0, min_open=True), default=None,
+              help="Items to write per second; defaults to 80% of the destination's provisioned write capacity")
+@click.option('--dest-batch-size', type=click.IntRange(1, ALTERNATOR_BATCH_WRITE_MAX_ITEMS),
+              default=BATCH_WRITE_MAX_ITEMS, show_default=True,
+              help="Items per BatchWriteItem call; DynamoDB allows 25, ScyllaDB Alternator allows up to 100")
+@click.option('--validate-credentials', is_flag=True, default=False,
+              help="Check both profiles' credentials with STS before copying, while the tables are loaded")
+@click.option('--mode', type=click.Choice(['scan', 'bulk', 'auto']), default='scan', show_default=True,
+              help="'scan' copies items with Scan and BatchWriteItem; 'bulk' exports the source table to S3 and "
+                   "imports it as a new destination table; 'auto' uses 'bulk' for tables over 10 GB or 100M items")
+@click.option('--s3-bucket', default=None, help="The S3 bucket to export to and import from in bulk mode")
+@click.option('--s3-prefix', default=None, help="The key prefix to export to in bulk mode")
+def run(src_table_name, src_profile, src_region, dest_table_name, dest_profile, dest_region, src_endpoint_url,
+        dest_endpoint_url, target_wps, dest_batch_size, validate_credentials, mode, s3_bucket, s3_prefix):
     click.echo(f"src_table = {src_table_name}")
-    click.echo(f"src_profile = {src_profile}")
+    if src_profile is not None:
+        click.echo(f"src_profile = {src_profile}")
     click.echo(f"src_region = {src_region}")
     click.echo(f"dest_table = {dest_table_name}")
-    click.echo(f"dest_profile = {dest_profile}")
+    if dest_profile is not None:
+        click.echo(f"dest_profile = {dest_profile}")
     click.echo(f"dest_region = {dest_region}")
+    if src_endpoint_url is not None:
+        click.echo(f"src_endpoint_url = {src_endpoint_url}")
+    if dest_endpoint_url is not None:
+        click.echo(f"dest_endpoint_url = {dest_endpoint_url}")
+
+    if mode != 'scan' and s3_bucket is None:
+        raise click.UsageError(f"--s3-bucket is required when --mode is '{mode}'")
+    if is_aws_endpoint(dest_endpoint_url) and dest_batch_size > BATCH_WRITE_MAX_ITEMS:
+        raise click.UsageError(f"--dest-batch-size can be at most {BATCH_WRITE_MAX_ITEMS} when writing to DynamoDB")
+
+    # Check the region names and profiles once, before anything connects to them
+    validate_region(src_region, src_endpoint_url)
+    validate_region(dest_region, dest_endpoint_url)
+    _session(src_profile, src_region)
+    _session(dest_profile, dest_region)
+
+    # Load the tables, checking that the profiles are valid at the same time if asked to. Otherwise bad credentials
+    # surface from loading the tables. A bulk copy creates the destination table, so it isn't loaded then.
+    with ThreadPoolExecutor() as executor:
+        validations = []
+        if validate_credentials:
+            validations = [
+                executor.submit(validate_aws_credentials, src_profile, src_region, src_endpoint_url),
+                executor.submit(validate_aws_credentials, dest_profile, dest_region, dest_endpoint_url),
+            ]
+        src_table_future = executor.submit(get_dynamodb_table, src_table_name, src_profile, src_region,
+                                           src_endpoint_url)
+        dest_table_future = None
+        if mode == 'scan':
+            dest_table_future = executor.submit(get_dynamodb_table, dest_table_name, dest_profile, dest_region,
+                                                dest_endpoint_url)
+
+        for validation in validations:
+            validation.result()
+        src_table = src_table_future.result()
 
-    # Check that the profiles are valid
-    validate_aws_credentials(src_profile, src_region)
-    validate_aws_credentials(dest_profile, dest_region)
+    if mode == 'auto':
+        mode = 'bulk' if should_copy_via_s3(src_table) else 'scan'
 
-    # Load the tables
-    src_table = get_dynamodb_table(src_table_name, src_profile, src_region)
-    dest_table = get_dynamodb_table(dest_table_name, dest_profile, dest_region)
+    if mode == 'bulk':
+        dest_client = _dynamodb_resource(dest_profile, dest_region, dest_endpoint_url).meta.client
+        copy_table_via_s3(src_table, dest_client, dest_table_name, s3_bucket, s3_prefix)
+        return
 
-    # Get the source table's items
-    src_items = get_dynamodb_items(src_table)
+    if dest_table_future is not None:
+        dest_table = dest_table_future.result()
+    else:
+        dest_table = get_dynamodb_table(dest_table_name, dest_profile, dest_region, dest_endpoint_url)
 
-    # Write the items to the destination table
-    write_items_to_dyanmodb_table(src_items, dest_table)
+    # Copy the source table's items to the destination table
+    rate_limiter = get_write_rate_limiter(dest_table, target_wps)
+    copy_table(src_table, dest_table, rate_limiter=rate_limiter, batch_size=dest_batch_size)
 
 
 if __name__ == '__main__':
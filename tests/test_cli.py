@@ -1,26 +1,92 @@
 import boto3
+import cli.cli
+import click
 import pytest
+import shutil
+import socket
+import subprocess
+import sys
+import time
 
-from cli import get_profile_names, get_dynamodb_table, get_dynamodb_items, write_items_to_dyanmodb_table
+from cli import get_profile_names, get_dynamodb_table, get_dynamodb_items, get_dynamodb_items_raw, \
+    iter_dynamodb_items, write_items_to_dyanmodb_table, copy_table, get_write_rate_limiter, is_aws_endpoint, \
+    validate_region, get_dynamodb_client, RawNumber, should_copy_via_s3, copy_table_via_s3, ProfileName, run, \
+    ThrottledCounter, LogCounter, progress_counter
+from click.testing import CliRunner
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import StringIO
+from itertools import chain
 from os import environ
 from pathlib import Path
+from threading import Barrier
+from types import SimpleNamespace
 
 
 SRC_TABLE_NAME = 'TEST_SOURCE'
 DEST_TABLE_NAME = 'TEST_DESTINATION'
+DYNAMODB_LOCAL_IMAGE = 'amazon/dynamodb-local'
+DYNAMODB_LOCAL_PORT = 8000
 
 
-@pytest.fixture
-def test_tables():
+@pytest.fixture(scope='session')
+def endpoint_url():
+    # Use an already running DynamoDB-compatible endpoint if one is given, otherwise start DynamoDB Local
+    if 'DYNAMODB_ENDPOINT_URL' in environ:
+        yield environ['DYNAMODB_ENDPOINT_URL']
+        return
+
+    if shutil.which('docker') is None:
+        pytest.skip("docker is required to start DynamoDB Local")
+
+    container_id = subprocess.run(
+        ['docker', 'run', '--rm', '-d', '-p', f"{DYNAMODB_LOCAL_PORT}:8000", DYNAMODB_LOCAL_IMAGE],
+        check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+    # Wait for DynamoDB Local to start accepting connections
+    for _ in range(50):
+        try:
+            socket.create_connection(('localhost', DYNAMODB_LOCAL_PORT), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.2)
+    else:
+        subprocess.run(['docker', 'stop', container_id], capture_output=True)
+        pytest.fail(f"DynamoDB Local did not start accepting connections on port {DYNAMODB_LOCAL_PORT}")
+
+    yield f"http://localhost:{DYNAMODB_LOCAL_PORT}"
+
+    subprocess.run(['docker', 'stop', container_id], check=True, capture_output=True)
+
+
+@pytest.fixture(scope='session')
+def ddb_session():
     aws_profile_name = 'default'
     if 'AWS_PROFILE' in environ:
         aws_profile_name = environ['AWS_PROFILE']
 
     aws_region = 'us-east-1'
     if 'AWS_DEFAULT_REGION' in environ:
-        aws_profile_name = environ['AWS_DEFAULT_REGION']
+        aws_region = environ['AWS_DEFAULT_REGION']
+
+    return boto3.Session(profile_name=aws_profile_name, region_name=aws_region)
+
+
+@pytest.fixture(scope='session')
+def table_location(ddb_session, endpoint_url):
+    # The profile, region and endpoint the test tables are created with, to load them with get_dynamodb_table
+    return ddb_session.profile_name, ddb_session.region_name, endpoint_url
+
+
+@pytest.fixture(scope='session')
+def ddb_client(ddb_session, endpoint_url):
+    return ddb_session.client('dynamodb', endpoint_url=endpoint_url)
+
 
-    dynamodb_client = boto3.Session(profile_name=aws_profile_name, region_name=aws_region).client('dynamodb')
+@pytest.fixture
+def test_tables(ddb_client):
+    dynamodb_client = ddb_client
 
     kwargs = {
         'AttributeDefinitions': [
@@ -42,7 +108,7 @@ def test_tables():
     for table_name in [SRC_TABLE_NAME, DEST_TABLE_NAME]:
         dynamodb_client.create_table(**kwargs, TableName=table_name)
         waiter = dynamodb_client.get_waiter('table_exists')
-        waiter.wait(TableName=SRC_TABLE_NAME)
+        waiter.wait(TableName=table_name)
 
     # Populate the source table with a few items
     for i in range(1, 3):
@@ -57,12 +123,24 @@ def test_tables():
     for table_name in [SRC_TABLE_NAME, DEST_TABLE_NAME]:
         dynamodb_client.delete_table(TableName=table_name)
         waiter = dynamodb_client.get_waiter('table_not_exists')
-        waiter.wait(TableName=SRC_TABLE_NAME)
+        waiter.wait(TableName=table_name)
+
+
+class StubBatchWriteClient:
+    """A stand-in for a DynamoDB client that returns canned BatchWriteItem responses in order"""
+
+    def __init__(self, responses):
+        self.responses = iter(responses)
+        self.requests = []
+
+    def batch_write_item(self, RequestItems):
+        self.requests.append(RequestItems)
+        return next(self.responses)
 
 
 class TestCli:
-    def test_get_profile_names(self):
-        environ['AWS_SHARED_CREDENTIALS_FILE'] = str(Path("resources/credentials"))
+    def test_get_profile_names(self, monkeypatch):
+        monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', str(Path(__file__).parent / "resources" / "credentials"))
 
         expected_profile_names = ["profile_1",
                                   "profile_2",
@@ -74,30 +152,107 @@ class TestCli:
         assert len(actual_profile_names) == 4
         assert expected_profile_names == actual_profile_names
 
-    def test_get_dynamodb_table(self, test_tables):
+    def test_profile_name(self, monkeypatch, tmp_path):
+        monkeypatch.setenv('AWS_SHARED_CREDENTIALS_FILE', str(Path(__file__).parent / "resources" / "credentials"))
+        config_path = tmp_path / "config"
+        config_path.write_text("[profile sso-user]\nsso_start_url = https://example.awsapps.com/start\n")
+        monkeypatch.setenv('AWS_CONFIG_FILE', str(config_path))
+
+        profile_name = ProfileName()
+        assert profile_name.convert('profile_1', None, None) == 'profile_1'
+        # Profiles only in the config file, e.g. SSO profiles, have no credentials file entry
+        assert profile_name.convert('sso-user', None, None) == 'sso-user'
+        with pytest.raises(click.BadParameter):
+            profile_name.convert('missing', None, None)
+
+    def test_throttled_counter(self):
+        # Nothing is redrawn until the interval has passed, but finishing flushes the pending count
+        counter = ThrottledCounter(interval=3600, file=StringIO())
+        for _ in range(5):
+            counter.next(10)
+        assert counter.index == 0
+        counter.finish()
+        assert counter.index == 50
+
+        counter = ThrottledCounter(interval=0, file=StringIO())
+        counter.next(10)
+        assert counter.index == 10
+
+    def test_log_counter(self, monkeypatch):
+        output = StringIO()
+        monkeypatch.setattr(cli.cli, 'stderr', output)
+
+        with LogCounter("Copied: ", every=10) as counter:
+            for _ in range(6):
+                counter.next(4)
+            assert output.getvalue().splitlines() == ["Copied: 12", "Copied: 20"]
+            counter.finish()
+
+        # Printed once more on finishing, and not again on leaving the with block
+        assert output.getvalue().splitlines() == ["Copied: 12", "Copied: 20", "Copied: 24"]
+
+    def test_progress_counter(self, monkeypatch):
+        monkeypatch.setattr(cli.cli, 'stderr', SimpleNamespace(isatty=lambda: True))
+        assert isinstance(progress_counter("Copied: "), ThrottledCounter)
+
+        monkeypatch.setattr(cli.cli, 'stderr', SimpleNamespace(isatty=lambda: False))
+        assert isinstance(progress_counter("Copied: "), LogCounter)
+
+    def test_get_dynamodb_table(self, test_tables, table_location):
         bad_table_name = 'FAKE_TABLE_NAME'
 
         actual_table_name, _ = test_tables
 
         with pytest.raises(SystemExit):
-            get_dynamodb_table(bad_table_name, 'default', 'us-east-1')
+            get_dynamodb_table(bad_table_name, *table_location)
 
-        actual_table = get_dynamodb_table(actual_table_name, 'default', 'us-east-1')
+        actual_table = get_dynamodb_table(actual_table_name, *table_location)
 
         assert actual_table.creation_date_time is not None
 
-    def test_get_dynamodb_items(self, test_tables):
+    def test_get_dynamodb_items(self, test_tables, table_location):
         test_table_name, _ = test_tables
-        table = get_dynamodb_table(test_table_name, ':wq', 'us-east-1')
+        table = get_dynamodb_table(test_table_name, *table_location)
 
         items = get_dynamodb_items(table)
 
         assert items is not None
 
-    def test_write_items_to_dyanmodb_table(self, test_tables):
+    def test_get_dynamodb_client_for_other_tables(self, test_tables, ddb_session, endpoint_url):
+        test_table_name, _ = test_tables
+        # A Table created directly with boto3 rather than with get_dynamodb_table
+        table = ddb_session.resource('dynamodb', endpoint_url=endpoint_url).Table(test_table_name)
+
+        client = get_dynamodb_client(table)
+        assert get_dynamodb_client(table) is client
+        assert client.meta.region_name == ddb_session.region_name
+
+        items = get_dynamodb_items_raw(client, test_table_name)
+        assert sorted(item['id']['S'] for item in items) == ['A100', 'A200']
+
+    def test_get_dynamodb_items_single_segment(self, test_tables, table_location):
+        test_table_name, _ = test_tables
+        table = get_dynamodb_table(test_table_name, *table_location)
+
+        parallel_items = get_dynamodb_items(table)
+        serial_items = get_dynamodb_items(table, parallelism=1)
+
+        assert sorted(item['id'] for item in parallel_items) == sorted(item['id'] for item in serial_items)
+
+    def test_get_dynamodb_items_raw(self, test_tables, table_location):
+        test_table_name, _ = test_tables
+        table = get_dynamodb_table(test_table_name, *table_location)
+
+        items = get_dynamodb_items_raw(get_dynamodb_client(table), test_table_name)
+        items = sorted(items, key=lambda item: item['id']['S'])
+
+        assert [item['id'] for item in items] == [{'S': 'A100'}, {'S': 'A200'}]
+        assert items[0]['data'] == {'S': 'Data for item with ID A100'}
+
+    def test_write_items_to_dyanmodb_table(self, test_tables, table_location):
         test_src_table_name, test_dest_table_name = test_tables
-        src_table = get_dynamodb_table(test_src_table_name, 'default', 'us-east-1')
-        dest_table = get_dynamodb_table(test_dest_table_name, 'default', 'us-east-1')
+        src_table = get_dynamodb_table(test_src_table_name, *table_location)
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
 
         src_items = get_dynamodb_items(src_table)
 
@@ -105,5 +260,252 @@ class TestCli:
 
         dest_items = get_dynamodb_items(dest_table)
 
-        assert dest_items == src_items
+        assert sorted(dest_items, key=lambda item: item['id']) == sorted(src_items, key=lambda item: item['id'])
+
+    def test_write_items_to_dyanmodb_table_numbers(self, test_tables, table_location):
+        _, test_dest_table_name = test_tables
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
+
+        write_items_to_dyanmodb_table([{'id': 'N100', 'count': 5, 'ratio': Decimal('0.25')}], dest_table)
+
+        dest_items = get_dynamodb_items(dest_table)
+
+        assert dest_items == [{'id': 'N100', 'count': '5', 'ratio': '0.25'}]
+        assert isinstance(dest_items[0]['count'], RawNumber)
+
+        write_items_to_dyanmodb_table(dest_items, dest_table)
+
+        assert get_dynamodb_items_raw(get_dynamodb_client(dest_table), test_dest_table_name)[0]['count'] == {'N': '5'}
+
+    def test_write_items_to_dyanmodb_table_from_pages(self, test_tables, table_location):
+        test_src_table_name, test_dest_table_name = test_tables
+        src_table = get_dynamodb_table(test_src_table_name, *table_location)
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
+
+        write_items_to_dyanmodb_table(chain.from_iterable(iter_dynamodb_items(src_table)), dest_table)
+
+        src_items = get_dynamodb_items(src_table)
+        dest_items = get_dynamodb_items(dest_table)
+
+        assert sorted(dest_items, key=lambda item: item['id']) == sorted(src_items, key=lambda item: item['id'])
+
+    def test_write_batch_retries_unprocessed_items(self, monkeypatch):
+        table = SimpleNamespace(table_name='TEST_TABLE')
+        batch = [{'id': {'S': f'A{i}'}} for i in range(3)]
+        unprocessed = {'TEST_TABLE': [{'PutRequest': {'Item': batch[0]}}]}
+        client = StubBatchWriteClient([{'UnprocessedItems': unprocessed}] * 3 + [{'UnprocessedItems': {}}])
+        sleeps = []
+        monkeypatch.setattr(cli.cli, 'get_dynamodb_client', lambda _: client)
+        monkeypatch.setattr(cli.cli, 'sleep', sleeps.append)
+
+        assert cli.cli._write_batch(table, batch) == 3
+
+        assert len(client.requests) == 4
+        assert client.requests[1:] == [unprocessed] * 3
+        assert len(sleeps) == 3
+
+    def test_write_batch_gives_up_on_unprocessed_items(self, monkeypatch):
+        table = SimpleNamespace(table_name='TEST_TABLE')
+        batch = [{'id': {'S': 'A100'}}]
+        unprocessed = {'TEST_TABLE': [{'PutRequest': {'Item': batch[0]}}]}
+        client = StubBatchWriteClient([{'UnprocessedItems': unprocessed}] * 100)
+        monkeypatch.setattr(cli.cli, 'get_dynamodb_client', lambda _: client)
+        monkeypatch.setattr(cli.cli, 'sleep', lambda seconds: None)
+
+        with pytest.raises(RuntimeError, match="1 items could not be written to TEST_TABLE"):
+            cli.cli._write_batch(table, batch)
+
+        assert len(client.requests) == cli.cli.UNPROCESSED_ITEMS_MAX_ATTEMPTS + 1
+
+    def test_get_write_rate_limiter(self, test_tables, table_location):
+        _, test_dest_table_name = test_tables
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
+
+        assert get_write_rate_limiter(dest_table) is None
+        assert get_write_rate_limiter(dest_table, target_wps=100).rate == 100
+
+    def test_copy_table(self, test_tables, table_location):
+        test_src_table_name, test_dest_table_name = test_tables
+        src_table = get_dynamodb_table(test_src_table_name, *table_location)
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
+
+        copy_table(src_table, dest_table)
+
+        src_items = get_dynamodb_items(src_table)
+        dest_items = get_dynamodb_items(dest_table)
+
+        assert sorted(dest_items, key=lambda item: item['id']) == sorted(src_items, key=lambda item: item['id'])
+
+    def test_is_aws_endpoint(self):
+        assert is_aws_endpoint(None)
+        assert is_aws_endpoint('https://dynamodb.us-east-1.amazonaws.com')
+        assert is_aws_endpoint('https://dynamodb.us-east-1.api.aws')
+        assert not is_aws_endpoint('http://localhost:8000')
+        assert not is_aws_endpoint('http://dynamodb-local:8000')
+
+    def test_run_rejects_large_batches_for_aws(self):
+        result = CliRunner().invoke(run, ['-st', 'src', '-sr', 'us-east-1', '-dt', 'dest', '-dr', 'us-east-1',
+                                          '--dest-batch-size', '100'])
+
+        assert result.exit_code == 2
+        assert "--dest-batch-size can be at most 25" in result.output
+
+    def test_validate_region(self, capsys, monkeypatch):
+        monkeypatch.setattr(cli.cli, 'stderr', sys.stderr)
+
+        assert validate_region('us-east-1') == 'us-east-1'
+        assert validate_region('local', 'http://localhost:8000') == 'local'
+        assert capsys.readouterr().err == ''
+
+        # A region newer than the bundled endpoint data, but following its partition's naming
+        assert validate_region('ap-southeast-99') == 'ap-southeast-99'
+        assert "'ap-southeast-99' is not known to this version of botocore" in capsys.readouterr().err
+
+        with pytest.raises(SystemExit):
+            validate_region('us-east')
+        with pytest.raises(SystemExit):
+            validate_region('useast1')
+        with pytest.raises(SystemExit):
+            validate_region('xx-east-1')
+
+    def test_copy_table_stops_scanning_after_write_error(self, test_tables, table_location, monkeypatch):
+        test_src_table_name, test_dest_table_name = test_tables
+        src_table = get_dynamodb_table(test_src_table_name, *table_location)
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
+
+        def endless_scan_pages(scan, segment=None, total_segments=None):
+            while True:
+                yield {'Items': [{'id': {'S': 'A100'}}], 'Count': 1}
+
+        def failing_write_batch(table, batch, rate_limiter=None):
+            raise RuntimeError("write failed")
+
+        monkeypatch.setattr(cli.cli, '_scan_pages', endless_scan_pages)
+        monkeypatch.setattr(cli.cli, '_write_batch', failing_write_batch)
 
+        with pytest.raises(RuntimeError, match="write failed"):
+            copy_table(src_table, dest_table)
+
+    def test_copy_table_stops_writing_after_write_error(self, test_tables, table_location, monkeypatch):
+        test_src_table_name, test_dest_table_name = test_tables
+        src_table = get_dynamodb_table(test_src_table_name, *table_location)
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
+        writes = []
+
+        def scan_pages(scan, segment=None, total_segments=None):
+            for i in range(100):
+                yield {'Items': [{'id': {'S': f'A{segment}-{i}'}}], 'Count': 1}
+
+        def failing_write_batch(table, batch, rate_limiter=None):
+            writes.append(batch)
+            raise RuntimeError("write failed")
+
+        monkeypatch.setattr(cli.cli, '_scan_pages', scan_pages)
+        monkeypatch.setattr(cli.cli, '_write_batch', failing_write_batch)
+
+        with pytest.raises(RuntimeError, match="write failed"):
+            copy_table(src_table, dest_table, writers=1)
+
+        # The queued pages are drained without being written once the first write fails
+        assert len(writes) == 1
+
+    def test_iter_pages_stops_other_segments_after_scan_error(self, monkeypatch):
+        def scan_pages(scan, segment=None, total_segments=None):
+            if segment == 0:
+                raise RuntimeError("scan failed")
+            while True:
+                yield {'Items': [], 'Count': 0}
+
+        monkeypatch.setattr(cli.cli, '_scan_pages', scan_pages)
+
+        with pytest.raises(RuntimeError, match="scan failed"):
+            for _ in cli.cli._iter_pages(None, parallelism=2, queue_maxsize=1):
+                pass
+
+    def test_dynamodb_resource_shared_across_threads(self, ddb_session, endpoint_url):
+        threads = 8
+        barrier = Barrier(threads)
+
+        def create_resource():
+            barrier.wait()
+            return cli.cli._dynamodb_resource(ddb_session.profile_name, 'eu-west-1', endpoint_url)
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(create_resource) for _ in range(threads)]
+            resources = [future.result() for future in futures]
+
+        assert all(resource is resources[0] for resource in resources)
+
+    def test_should_copy_via_s3(self):
+        small_table = SimpleNamespace(table_size_bytes=1024, item_count=10)
+        large_table = SimpleNamespace(table_size_bytes=20 * 1024 ** 3, item_count=10)
+        many_items_table = SimpleNamespace(table_size_bytes=1024, item_count=200_000_000)
+
+        assert not should_copy_via_s3(small_table)
+        assert should_copy_via_s3(large_table)
+        assert should_copy_via_s3(many_items_table)
+
+    def test_table_creation_parameters(self):
+        table = SimpleNamespace(
+            attribute_definitions=[
+                {'AttributeName': 'id', 'AttributeType': 'S'},
+                {'AttributeName': 'created', 'AttributeType': 'N'},
+                {'AttributeName': 'owner', 'AttributeType': 'S'},
+            ],
+            key_schema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            billing_mode_summary=None,
+            provisioned_throughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 10, 'NumberOfDecreasesToday': 0},
+            global_secondary_indexes=[{
+                'IndexName': 'by-owner',
+                'KeySchema': [{'AttributeName': 'owner', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 2, 'NumberOfDecreasesToday': 0},
+                'IndexStatus': 'ACTIVE',
+            }],
+        )
+
+        params = cli.cli._table_creation_parameters(table, 'COPY')
+
+        # 'created' is only the sort key of a local secondary index, which an import can't create
+        assert params == {
+            'TableName': 'COPY',
+            'AttributeDefinitions': [
+                {'AttributeName': 'id', 'AttributeType': 'S'},
+                {'AttributeName': 'owner', 'AttributeType': 'S'},
+            ],
+            'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            'BillingMode': 'PROVISIONED',
+            'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 10},
+            'GlobalSecondaryIndexes': [{
+                'IndexName': 'by-owner',
+                'KeySchema': [{'AttributeName': 'owner', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 2},
+            }],
+        }
+
+    def test_table_creation_parameters_on_demand(self):
+        table = SimpleNamespace(
+            attribute_definitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+            key_schema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            billing_mode_summary={'BillingMode': 'PAY_PER_REQUEST'},
+            provisioned_throughput={'ReadCapacityUnits': 0, 'WriteCapacityUnits': 0, 'NumberOfDecreasesToday': 0},
+            global_secondary_indexes=None,
+        )
+
+        params = cli.cli._table_creation_parameters(table, 'COPY')
+
+        assert params == {
+            'TableName': 'COPY',
+            'AttributeDefinitions': [{'AttributeName': 'id', 'AttributeType': 'S'}],
+            'KeySchema': [{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            'BillingMode': 'PAY_PER_REQUEST',
+        }
+
+    def test_copy_table_via_s3_existing_destination(self, test_tables, table_location):
+        test_src_table_name, test_dest_table_name = test_tables
+        src_table = get_dynamodb_table(test_src_table_name, *table_location)
+        dest_table = get_dynamodb_table(test_dest_table_name, *table_location)
+
+        with pytest.raises(SystemExit):
+            copy_table_via_s3(src_table, dest_table.meta.client, test_dest_table_name, 'bucket')